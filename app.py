@@ -1,16 +1,22 @@
 # app.py
 import base64
+import json
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, List, Tuple
 import gspread
+import numpy as np
 import pandas as pd
 import re
+import requests
+import sys
+import time
 import streamlit as st
-from PIL import Image
-from datetime import datetime
+import streamlit.components.v1 as components
+from streamlit.errors import StreamlitAPIException
+import google.auth.exceptions
 from google.oauth2.service_account import Credentials
-import folium
-from streamlit_folium import st_folium
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 0) PAGE CONFIG + LOGO
@@ -18,19 +24,19 @@ from streamlit_folium import st_folium
 APP_DIR = Path(__file__).parent
 LOGO_PATH = APP_DIR / "ideamaps.png"
 
-_logo_img = None
+# Logo lido uma única vez (sem decode PIL): bytes para a sidebar, base64 para o favicon
+_logo_bytes = None
 _logo_b64 = None
 if LOGO_PATH.exists():
     try:
-        _logo_img = Image.open(LOGO_PATH)
-        with open(LOGO_PATH, "rb") as f:
-            _logo_b64 = base64.b64encode(f.read()).decode("utf-8")
+        _logo_bytes = LOGO_PATH.read_bytes()
+        _logo_b64 = base64.b64encode(_logo_bytes).decode("utf-8")
     except Exception:
-        _logo_img, _logo_b64 = None, None
+        _logo_bytes, _logo_b64 = None, None
 
 st.set_page_config(
     page_title="IDEAMAPS Global Metadata Explorer",
-    page_icon=_logo_img if _logo_img is not None else "🌍",
+    page_icon=f"data:image/png;base64,{_logo_b64}" if _logo_b64 else "🌍",
     layout="wide",
 )
 if _logo_b64:
@@ -60,6 +66,8 @@ for k, v in {
     "_outputs_editor_key_version": 0,
     "_table_selection": None,
     "_action_reason": "",
+    "_pending_writes": [],
+    "_write_errors": [],
 }.items():
     if k not in ss:
         ss[k] = v
@@ -67,6 +75,13 @@ for k, v in {
 def wkey(name: str) -> str:
     return f"{name}__v{ss._form_version}"
 
+def rerun_fragment():
+    """Reexecuta só o fragment atual; numa execução completa cai para rerun normal."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
 def flash(message: str, level: str = "success"):
     ss._flash = {"msg": message, "level": level}
 
@@ -103,8 +118,50 @@ def show_post_submit_dialog():
                     ss._post_submit_msg = ""
                     st.rerun()
 
+def drain_pending_writes() -> bool:
+    """
+    Recolhe as gravações em background que já terminaram; falhas vão para
+    _write_errors (mostradas no form). True se alguma terminou.
+    """
+    pending = ss.get("_pending_writes") or []
+    done = [f for f in pending if f.done()]
+    if not done:
+        return False
+    ss._pending_writes = [f for f in pending if f not in done]
+    for fut in done:
+        try:
+            ok, msg = fut.result()
+        except Exception as e:
+            ok, msg = False, f"Write error: {e}"
+        if not ok:
+            ss._write_errors = ss._write_errors + [msg]
+    return True
+
+def show_write_errors():
+    errs = ss.get("_write_errors") or []
+    if not errs:
+        return
+    with st.container(border=True):
+        for msg in errs:
+            st.error(f"⚠️ A submission could not be saved: {msg}")
+        if st.button("Dismiss", key="dismiss_write_errors"):
+            ss._write_errors = []
+            rerun_fragment()
+
+@st.fragment(run_every=2)
+def pending_writes_poller():
+    """
+    Só é desenhado enquanto há gravação pendente: confere a cada 2s. Quando
+    alguma falha ou não resta nenhuma pendente, faz rerun completo: o erro
+    aparece no form e o poller deixa de ser desenhado (o intervalo só é
+    cancelado por rerun do app).
+    """
+    finished = drain_pending_writes()
+    if (finished and ss._write_errors) or not ss._pending_writes:
+        st.rerun()
+
+drain_pending_writes()
 show_flash()
-show_post_submit_dialog()
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 1) SHEETS
@@ -140,23 +197,43 @@ OUTPUTS_HEADERS = [
     "lat","lon"
 ]
 
+# Chaves internadas: lookups em dicts de linha/índice comparam por identidade
+PROJECTS_HEADERS = [sys.intern(h) for h in PROJECTS_HEADERS]
+OUTPUTS_HEADERS  = [sys.intern(h) for h in OUTPUTS_HEADERS]
+
+# Linha de output na ordem de OUTPUTS_HEADERS (vira lista sem remapear em _append_rows)
+OutputRow = namedtuple("OutputRow", OUTPUTS_HEADERS)
+
+# Coluna → posição, calculados uma vez no import
+PROJECTS_HEADER_INDEX = {h: i for i, h in enumerate(PROJECTS_HEADERS)}
+OUTPUTS_HEADER_INDEX  = {h: i for i, h in enumerate(OUTPUTS_HEADERS)}
+
+# Sentinelas usados no form e na submissão
+GLOBAL = "Global"
+OTHER_COUNTRY = "Other: ______"
+DATASET = "Dataset"
+OTHER_PREFIX = "Other"
+
 PROJECT_TAXONOMY = [
     "IDEAMAPS Networking Grant","IDEAMAPSudan","SLUMAP","Data4HumanRights",
     "IDEAMAPS Data Ecosystem","Night Watch","ONEKANA","Space4All",
     "IDEAtlas","DEPRIMAP","URBE Latem","Other: ______"
 ]
-OUTPUT_TYPES = ["Dataset","Code / App / Tool","Document","Academic Paper","Other: ________"]
+OUTPUT_TYPES = [DATASET,"Code / App / Tool","Document","Academic Paper","Other: ________"]
 DATASET_DTYPES = [
     "Spatial (eg shapefile)",
     "Qualitative (eg audio recording)",
     "Quantitative (eg survey results)"
 ]
 SELECT_PLACEHOLDER = "— Select —"
+# Opções do multiselect de países que não são países (sem centro nem cidades)
+_NON_COUNTRY = frozenset((GLOBAL, OTHER_COUNTRY))
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 2) Google Sheets helpers
 # ──────────────────────────────────────────────────────────────────────────────
-@st.cache_resource(show_spinner=False)
+# Falha de auth não fica presa no cache: o próximo acesso tenta de novo
+@st.cache_resource(show_spinner=False, validate=lambda res: res[0] is not None)
 def _gs_client():
     try:
         creds_info = st.secrets.get("gcp_service_account")
@@ -170,6 +247,19 @@ def _gs_client():
     except Exception as e:
         return None, f"Google Sheets auth error: {e}"
 
+# Cabeçalho reconciliado por aba e seu índice coluna → posição
+# (preenchidos em _remember_header, lidos em _append_rows)
+_SHEET_HEADERS: dict[str, List[str]] = {}
+_SHEET_HEADER_INDEX: dict[str, dict[str, int]] = {}
+
+def _remember_header(ws_name: str, header: List[str]):
+    _SHEET_HEADERS[ws_name] = header
+    _SHEET_HEADER_INDEX[ws_name] = (
+        PROJECTS_HEADER_INDEX if header == PROJECTS_HEADERS
+        else OUTPUTS_HEADER_INDEX if header == OUTPUTS_HEADERS
+        else {h: i for i, h in enumerate(header)}
+    )
+
 def _open_or_create(ws_name: str, headers: Optional[List[str]] = None):
     client, err = _gs_client()
     if err or client is None:
@@ -191,41 +281,115 @@ def _open_or_create(ws_name: str, headers: Optional[List[str]] = None):
     except Exception as e:
         return None, f"Worksheet error: {e}"
     try:
-        current = ws.row_values(1) or []
+        current = [sys.intern(h) for h in (ws.row_values(1) or [])]
         missing = [h for h in (headers or []) if h not in current]
         if missing:
             ws.update("A1", [current + missing])
+        _remember_header(ws_name, current + missing)
     except Exception:
         pass
     return ws, None
 
-def ws_projects(): return _open_or_create(PROJECTS_SHEET, PROJECTS_HEADERS)
-def ws_outputs():  return _open_or_create(OUTPUTS_SHEET,  OUTPUTS_HEADERS)
+@st.cache_resource(show_spinner=False)
+def _cached_worksheet(ws_name: str, headers: Tuple[str, ...]):
+    """
+    Handle da aba + cabeçalho reconciliado, abertos uma vez por processo.
+    Erros viram exceção para não ficarem em cache.
+    """
+    ws, err = _open_or_create(ws_name, list(headers))
+    if err or ws is None:
+        raise RuntimeError(err or "Worksheet unavailable.")
+    return ws, _SHEET_HEADERS.get(ws_name)
 
-def _append_row(ws, headers, row_dict: dict) -> Tuple[bool, str]:
+def _worksheet(ws_name: str, headers: List[str]):
     try:
-        header = ws.row_values(1) or headers
-        values = [row_dict.get(col, "") for col in header]
-        ws.append_row(values, value_input_option="RAW")
-        return True, "Saved."
-    except Exception as e:
-        return False, f"Write error: {e}"
+        ws, header = _cached_worksheet(ws_name, tuple(headers))
+    except RuntimeError as e:
+        return None, str(e)
+    if header:
+        _remember_header(ws_name, header)
+    return ws, None
+
+def ws_projects(): return _worksheet(PROJECTS_SHEET, PROJECTS_HEADERS)
+def ws_outputs():  return _worksheet(OUTPUTS_SHEET,  OUTPUTS_HEADERS)
+
+# Status do Sheets que valem nova tentativa (quota / indisponibilidade temporária).
+# 500 fica de fora: o append pode ter sido gravado e repetir duplicaria a linha.
+_RETRYABLE_STATUS = {429, 503}
+_WRITE_ATTEMPTS = 3
+
+def _append_rows(ws, headers, row_dicts: list) -> Tuple[bool, str]:
+    """
+    Grava várias linhas numa única chamada à API (append_rows).
+    Aceita dicts ou namedtuples (ex.: OutputRow); namedtuples na mesma ordem
+    do cabeçalho da aba vão direto como lista.
+    """
+    if not row_dicts:
+        return True, "Nothing to save."
+    sheet_header = _SHEET_HEADERS.get(ws.title) or headers
+    idx = _SHEET_HEADER_INDEX.get(ws.title) or {h: i for i, h in enumerate(headers)}
+    width = len(sheet_header)
+    values = []
+    for row_dict in row_dicts:
+        if isinstance(row_dict, tuple):
+            if list(row_dict._fields) == sheet_header:
+                values.append(list(row_dict))
+                continue
+            row_dict = row_dict._asdict()
+        vec = [""] * width
+        for col, val in row_dict.items():
+            i = idx.get(col)
+            if i is not None:
+                vec[i] = val
+        values.append(vec)
+    for attempt in range(_WRITE_ATTEMPTS):
+        try:
+            ws.append_rows(values, value_input_option="RAW", insert_data_option="INSERT_ROWS")
+            return True, "Saved."
+        except gspread.exceptions.APIError as e:
+            if e.code in _RETRYABLE_STATUS and attempt + 1 < _WRITE_ATTEMPTS:
+                time.sleep(2 ** attempt)
+                continue
+            return False, f"Write error: {e}"
+        except (requests.RequestException, google.auth.exceptions.GoogleAuthError) as e:
+            # Rede ou refresh do token (RefreshError/TransportError)
+            return False, f"Write error: {e}"
+
+def _append_row(ws, headers, row_dict: dict) -> Tuple[bool, str]:
+    return _append_rows(ws, headers, [row_dict])
+
+@st.cache_resource(show_spinner=False)
+def _writer_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="sheets-writer")
+
+def _write_submission(wsP, rowsP: List[dict], wsO, rowsO: List[OutputRow]) -> Tuple[bool, str]:
+    """Roda no pool (sem st.*): projetos novos primeiro, depois os outputs."""
+    if rowsP:
+        ok, msg = _append_rows(wsP, PROJECTS_HEADERS, rowsP)
+        if not ok:
+            return ok, msg
+    return _append_rows(wsO, OUTPUTS_HEADERS, rowsO)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 3) Utils
 # ──────────────────────────────────────────────────────────────────────────────
+_RE_NONNUM_SIGN = re.compile(r"[^\d\-\+]")
+_RE_NONDIGIT = re.compile(r"\D")
+
 def _parse_number_loose(x):
     if x is None or (isinstance(x, float) and pd.isna(x)): return None
+    # Já numérico: nada a limpar
+    if isinstance(x, (int, float)) and not isinstance(x, bool): return float(x)
     s = str(x).strip().strip("'").strip('"')
     if not s: return None
     if ("," in s) or ("." in s):
         last = max(s.rfind(","), s.rfind("."))
         if last >= 0:
-            intp = re.sub(r"[^\d\-\+]", "", s[:last]) or "0"
-            frac = re.sub(r"\D", "", s[last+1:]) or "0"
+            intp = _RE_NONNUM_SIGN.sub("", s[:last]) or "0"
+            frac = _RE_NONDIGIT.sub("", s[last+1:]) or "0"
             try: return float(f"{intp}.{frac}")
             except Exception: pass
-    raw = re.sub(r"[^\d\-\+]", "", s)
+    raw = _RE_NONNUM_SIGN.sub("", s)
     try: return float(raw)
     except Exception:
         try: return float(s.replace(",", "."))
@@ -235,18 +399,43 @@ def _as_float(x):
     v = _parse_number_loose(x)
     return float(v) if v is not None else None
 
+def _to_float_series(col: pd.Series) -> pd.Series:
+    """
+    Versão vetorizada de _as_float: pd.to_numeric resolve os valores limpos
+    (vírgula decimal incluída); só o que falhar passa pelo parser tolerante.
+    """
+    txt = col.astype(str).str.strip()
+    fast = pd.to_numeric(txt.str.replace(",", ".", regex=False), errors="coerce")
+    retry = fast.isna() & col.notna() & txt.ne("")
+    if retry.any():
+        fast.loc[retry] = col[retry].apply(_as_float).astype(float)
+    return fast
+
 def _clean_url(u):
-    s = (u or "").strip()
-    return s if (s.startswith("http://") or s.startswith("https://")) else s
+    return (u or "").strip()
 
 def _ulid_like():
-    return datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    return str(time.time_ns())
+
+def _now_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+def _csv(xs: list, sep: str = ", ") -> str:
+    """Join para listas curtas (caso comum: 1–2 itens) sem passar pelo join genérico."""
+    n = len(xs)
+    if n == 0:
+        return ""
+    if n == 1:
+        return str(xs[0])
+    if n == 2:
+        return f"{xs[0]}{sep}{xs[1]}"
+    return sep.join(map(str, xs))
 
 def _countries_with_global_first(names: List[str]):
-    if "Global" in names:
-        return ["Global"] + [n for n in names if n != "Global"]
+    if GLOBAL in names:
+        return [GLOBAL] + [n for n in names if n != GLOBAL]
     else:
-        return ["Global"] + names
+        return [GLOBAL] + names
 
 # ===== Validations =====
 def _missing_list_to_md(missing: list[str]) -> str:
@@ -259,17 +448,30 @@ def _show_missing(missing: list[str]):
     if missing:
         st.warning(_missing_list_to_md(missing))
 
+# Limite de caracteres por célula do Google Sheets: texto maior falharia só na gravação
+MAX_CELL_CHARS = 50_000
+_FREE_TEXT_LABELS = {
+    "output_title": "Output name", "output_desc": "Short description", "output_url": "Output URL",
+    "output_contact": "Contact", "output_linkedin": "LinkedIn address", "output_type_other": "Output type",
+    "output_country_other": "Other geographic coverage", "project_tax_other": "Project name",
+    "project_url_for_output": "Project URL", "new_project_url": "Project URL",
+    "new_project_contact": "Project contact",
+}
+
 def _collect_missing_for_submit(state: dict, *, is_edit_mode: bool, cities: list[str]) -> list[str]:
     missing = []
+    for k, label in _FREE_TEXT_LABELS.items():
+        if len(state.get(k) or "") > MAX_CELL_CHARS:
+            missing.append(f"{label} shorter than {MAX_CELL_CHARS:,} characters")
     if not (state.get("submitter_email") or "").strip():
         missing.append("Submitter email")
     if not (state.get("output_title") or "").strip():
         missing.append("Output name")
     if not (state.get("output_countries") or []):
         missing.append("At least one country")
-    if (state.get("output_type_sel") == "Dataset") and (state.get("output_data_type") in (None, "", SELECT_PLACEHOLDER)):
+    if (state.get("output_type_sel") == DATASET) and (state.get("output_data_type") in (None, "", SELECT_PLACEHOLDER)):
         missing.append("Data type (for datasets)")
-    if (state.get("project_tax_sel") or "").startswith("Other") and not (state.get("project_tax_other") or "").strip():
+    if (state.get("project_tax_sel") or "").startswith(OTHER_PREFIX) and not (state.get("project_tax_other") or "").strip():
         missing.append("Project name (when selecting 'Other')")
     if is_edit_mode:
         if not (ss.get("_edit_target_row") or None):
@@ -291,26 +493,68 @@ def _collect_missing_for_table_action(selection_idx: int | None, reason: str, ac
 # ──────────────────────────────────────────────────────────────────────────────
 COUNTRY_CSV_PATH = APP_DIR / "country-coord.csv"
 
-@st.cache_data(show_spinner=False)
-def load_country_centers():
+# Centros por país e as estruturas derivadas, montados juntos uma vez por processo
+# (o script reexecuta a cada interação; aqui só se reatribuem os nomes)
+CountryCenters = namedtuple("CountryCenters", ["mapping", "df", "options", "lat_s", "lon_s"])
+
+def _read_country_csv() -> dict:
     try:
         df = pd.read_csv(COUNTRY_CSV_PATH, dtype=str, encoding="utf-8", on_bad_lines="skip")
         df.columns = [c.strip().lower() for c in df.columns]
         c_country = "country"; c_lat = "latitude (average)"; c_lon = "longitude (average)"
         if c_country not in df.columns or c_lat not in df.columns or c_lon not in df.columns:
             st.error("CSV must contain: 'Country', 'Latitude (average)', 'Longitude (average)'.")
-            return {}, pd.DataFrame()
-        df["lat"] = df[c_lat].apply(_parse_number_loose)
-        df["lon"] = df[c_lon].apply(_parse_number_loose)
+            return {}
+        df["lat"] = _to_float_series(df[c_lat])
+        df["lon"] = _to_float_series(df[c_lon])
         df = df.dropna(subset=["lat", "lon"])
-        mapping = {row[c_country]: (float(row["lat"]), float(row["lon"])) for _, row in df.iterrows()}
-        return mapping, df
+        lats = df["lat"].astype(float).tolist()
+        lons = df["lon"].astype(float).tolist()
+        return dict(zip(df[c_country].tolist(), zip(lats, lons)))
     except Exception as e:
         st.error(f"Error loading country centers: {e}")
-        return {}, pd.DataFrame()
+        return {}
+
+# CSV local e estático: um parse por dia basta. cache_resource: mesmos objetos
+# a cada rerun, sem cópia; quem consome trata como somente leitura.
+@st.cache_resource(ttl=86400, show_spinner=False)
+def load_country_centers() -> CountryCenters:
+    mapping = _read_country_csv()
+    df = pd.DataFrame(
+        [(k, v[0], v[1]) for k, v in mapping.items()],
+        columns=["country", "lat", "lon"],
+    )
+    by_country = df.set_index("country")
+    return CountryCenters(
+        mapping=mapping,
+        df=df,
+        # Opções do multiselect de países: Global primeiro, "Other" no fim
+        options=tuple(_countries_with_global_first(sorted(mapping)) + [OTHER_COUNTRY]),
+        lat_s=by_country["lat"],
+        lon_s=by_country["lon"],
+    )
+
+_CENTERS = load_country_centers()
+COUNTRY_CENTER_FULL = _CENTERS.mapping
+COUNTRY_OPTIONS = _CENTERS.options
+COUNTRY_CENTERS_DF = _CENTERS.df
+_COUNTRY_LAT_S = _CENTERS.lat_s
+_COUNTRY_LON_S = _CENTERS.lon_s
 
-COUNTRY_CENTER_FULL, _df_countries = load_country_centers()
-COUNTRY_NAMES = sorted(COUNTRY_CENTER_FULL.keys()) if COUNTRY_CENTER_FULL else []
+def _center(country: Optional[str]) -> Optional[Tuple[float, float]]:
+    # Consulta direta ao dict em cache (já guarda (lat, lon) como float)
+    return COUNTRY_CENTER_FULL.get(country) if country else None
+
+def _centers_for(countries: list[str]) -> list[tuple]:
+    """
+    Resolve (country, lat, lon) para vários países num único merge,
+    preservando a ordem recebida; lat/lon = None quando o país não tem centro.
+    """
+    if not countries:
+        return []
+    df = pd.DataFrame({"country": countries}).merge(COUNTRY_CENTERS_DF, on="country", how="left")
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 5) Header
@@ -327,127 +571,334 @@ projects…</p>
 </div>
 """, unsafe_allow_html=True)
 
-if _logo_img is not None:
-    st.sidebar.image(_logo_img, caption="IDEAMAPS", use_container_width=True)
+if _logo_bytes is not None:
+    st.sidebar.image(_logo_bytes, caption="IDEAMAPS", use_container_width=True)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 6) Carregamento (apenas aprovados)
 # ──────────────────────────────────────────────────────────────────────────────
-@st.cache_data(show_spinner=False)
-def load_projects_public():
-    ws, err = ws_projects()
-    if err or ws is None: return pd.DataFrame(), False, err
+def _secret_int(name: str, default: int) -> int:
     try:
-        df = pd.DataFrame(ws.get_all_records())
-        if df.empty:
-            return df, True, None
+        return int(st.secrets.get(name, default))
+    except Exception:
+        return default
+
+# Contadores de cache só com DEBUG_CACHE em st.secrets (em produção não custam nada)
+DEBUG_CACHE = bool(_secret_int("DEBUG_CACHE", 0))
+
+@st.cache_resource(show_spinner=False)
+def _cache_counters() -> dict:
+    """Contadores por processo: execuções do script e cache misses dos loaders/mapas."""
+    return {"runs": 0, "misses": {}, "last_miss": {}}
+
+def _count_miss(name: str):
+    if not DEBUG_CACHE:
+        return
+    c = _cache_counters()
+    c["misses"][name] = c["misses"].get(name, 0) + 1
+    c["last_miss"][name] = _now_iso()
+
+# Leituras do Sheets expiram sozinhas; "Check updates" continua forçando na hora.
+# Os dados só mudam com moderação, então o TTL é longo (ajustável em st.secrets).
+SHEETS_TTL = _secret_int("SHEETS_TTL_SECONDS", 1800)
+
+# Snapshot em disco da última leitura: worker reiniciado dentro do TTL não vai ao Sheets.
+# O snapshot lido ainda fica em cache por mais um TTL (dado até 2× TTL; ver README).
+# Só guarda o que as telas públicas usam (ver _public_values): linhas não aprovadas
+# ficam vazias (mantêm a posição = sheet_row) e colunas de e-mail vão em branco.
+_SNAPSHOT_DIR = Path.home() / ".cache" / "ideamaps"
+_PRIVATE_COLS = frozenset(("submitter_email", "output_email"))
+
+def _public_values(vals: List[list]) -> List[list]:
+    """Linhas cruas de uma aba → só aprovadas e sem e-mails, preservando a posição de cada linha."""
+    if not vals:
+        return vals
+    header = vals[0]
+    try:
+        i_appr = header.index("approved")
+    except ValueError:
+        return [header]
+    private = [i for i, h in enumerate(header) if h in _PRIVATE_COLS]
+    out = [header]
+    for r in vals[1:]:
+        if i_appr < len(r) and str(r[i_appr]).upper() in ("TRUE", "1", "YES"):
+            if private:
+                r = list(r)
+                for i in private:
+                    if i < len(r):
+                        r[i] = ""
+            out.append(r)
+        else:
+            out.append([])
+    return out
+
+def _snapshot_path() -> Optional[Path]:
+    try:
+        ss_id = st.secrets.get("SHEETS_SPREADSHEET_ID")
+    except Exception:
+        return None
+    return (_SNAPSHOT_DIR / f"sheets_public_{ss_id}.json") if ss_id else None
+
+def _read_snapshot() -> Optional[dict]:
+    path = _snapshot_path()
+    try:
+        if path and (time.time() - path.stat().st_mtime) < SHEETS_TTL:
+            return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        pass
+    return None
+
+def _write_snapshot(raw: dict):
+    path = _snapshot_path()
+    if not path:
+        return
+    try:
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(raw), encoding="utf-8")
+        tmp.chmod(0o600)
+        tmp.replace(path)
+    except Exception:
+        pass  # snapshot é só otimização; falha aqui não afeta a leitura
+
+def _drop_snapshot():
+    path = _snapshot_path()
+    try:
+        if path:
+            path.unlink(missing_ok=True)
+    except Exception:
+        pass
+
+@st.cache_data(ttl=SHEETS_TTL, show_spinner=False)
+def _fetch_sheets_raw() -> dict:
+    """
+    Valores crus das duas abas numa única chamada (values_batch_get).
+    Erros viram exceção (RuntimeError) para não ficarem em cache pelo TTL.
+    """
+    _count_miss("_fetch_sheets_raw")
+    snap = _read_snapshot()
+    if snap is not None:
+        return snap
+    wsP, errP = ws_projects()
+    wsO, errO = ws_outputs()
+    if errP or errO or wsP is None or wsO is None:
+        raise RuntimeError(errP or errO or "Worksheet unavailable.")
+    try:
+        names = [PROJECTS_SHEET, OUTPUTS_SHEET]
+        res = wsO.spreadsheet.values_batch_get(
+            [gspread.utils.absolute_range_name(n) for n in names])
+        ranges = res.get("valueRanges", [])
+        # Só aprovados e sem e-mails, também em memória: é tudo que os loaders públicos usam
+        raw = {n: _public_values(vr.get("values", [])) for n, vr in zip(names, ranges)}
+    except Exception as e:
+        raise RuntimeError(f"Read error: {e}") from e
+    _write_snapshot(raw)
+    return raw
+
+def _values_frame(vals: List[list]) -> pd.DataFrame:
+    """Linhas cruas (cabeçalho na 1ª) → DataFrame; linhas curtas completadas com ""."""
+    header = vals[0]
+    n = len(header)
+    rows = [r if len(r) == n else (r[:n] + [""] * (n - len(r))) for r in vals[1:]]
+    return pd.DataFrame(rows, columns=header)
+
+@st.cache_data(ttl=SHEETS_TTL, show_spinner=False)
+def _load_projects_frame() -> pd.DataFrame:
+    raw = _fetch_sheets_raw()
+    try:
+        vals = raw.get(PROJECTS_SHEET) or []
+        if len(vals) < 2:
+            return pd.DataFrame()
+        df = _values_frame(vals)
         for c in PROJECTS_HEADERS:
             if c not in df.columns:
                 df[c] = ""
         df["approved"] = df["approved"].astype(str).str.upper().isin(["TRUE","1","YES"])
         df = df[df["approved"]].copy()
-        if "lat" in df.columns: df["lat"] = df["lat"].apply(_as_float)
-        if "lon" in df.columns: df["lon"] = df["lon"].apply(_as_float)
-        return df, True, None
+        if "lat" in df.columns: df["lat"] = _to_float_series(df["lat"])
+        if "lon" in df.columns: df["lon"] = _to_float_series(df["lon"])
+        return df
     except Exception as e:
-        return pd.DataFrame(), False, f"Read error: {e}"
+        raise RuntimeError(f"Read error: {e}") from e
 
-@st.cache_data(show_spinner=False)
-def load_outputs_public():
-    ws, err = ws_outputs()
-    if err or ws is None:
-        return pd.DataFrame(), False, err
+def load_projects_public():
     try:
-        vals = ws.get_all_values()
-        if not vals or len(vals) < 2:
-            return pd.DataFrame(), True, None
-        header = vals[0]
-        rows = vals[1:]
-        recs = []
-        for i, r in enumerate(rows, start=2):  # sheet row index (header is 1)
-            data = {h: (r[j] if j < len(r) else "") for j, h in enumerate(header)}
-            data["sheet_row"] = i
-            recs.append(data)
-        df = pd.DataFrame(recs)
-
-        for c in OUTPUTS_HEADERS:
-            if c not in df.columns:
-                df[c] = ""
+        return _load_projects_frame(), True, None
+    except RuntimeError as e:
+        return pd.DataFrame(), False, str(e)
+
+# Outputs em cache_resource: o mesmo DataFrame é devolvido a cada rerun, sem a cópia
+# (unpickle) do cache_data. Quem consome trata como somente leitura.
+@st.cache_resource(ttl=SHEETS_TTL, show_spinner=False)
+def _fetch_outputs_raw():
+    """
+    Aba de outputs crua (todas as linhas + sheet_row), sem tratamento,
+    e o fingerprint do conteúdo (calculado só aqui, uma vez por leitura).
+    Erros viram exceção, como em _fetch_sheets_raw.
+    """
+    raw = _fetch_sheets_raw()
+    try:
+        vals = raw.get(OUTPUTS_SHEET) or []
+        if len(vals) < 2:
+            return pd.DataFrame(), 0
+        df = _values_frame(vals)
+        df["sheet_row"] = np.arange(2, len(df) + 2)  # sheet row index (header is 1)
+        fp = int(pd.util.hash_pandas_object(df, index=False).sum())
+        return df, fp
+    except Exception as e:
+        raise RuntimeError(f"Read error: {e}") from e
 
-        df["approved"] = df["approved"].astype(str).str.upper().isin(["TRUE","1","YES"])
-        df = df[df["approved"]].copy()
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _postprocess_outputs(fingerprint: int, _df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Filtro de aprovados + coords (com fallback pelo centro do país).
+    Cacheado pelo fingerprint do conteúdo bruto (`_df` não entra no hash).
+    """
+    _count_miss("_postprocess_outputs")
+    df = _df.copy()
+    for c in OUTPUTS_HEADERS:
+        if c not in df.columns:
+            df[c] = ""
+
+    df["approved"] = df["approved"].astype(str).str.upper().isin(["TRUE","1","YES"])
+    df = df[df["approved"]].copy()
+
+    lat = _to_float_series(df["lat"])
+    lon = _to_float_series(df["lon"])
 
-        df["lat"] = df.get("lat", "").apply(_as_float)
-        df["lon"] = df.get("lon", "").apply(_as_float)
-
-        def _fallback_coords(row):
-            if pd.notna(row.get("lat")) and pd.notna(row.get("lon")):
-                return row["lat"], row["lon"]
-            ctry = str(row.get("output_country","")).strip()
-            if ctry in COUNTRY_CENTER_FULL:
-                return COUNTRY_CENTER_FULL[ctry]
-            return None, None
-
-        lats, lons = [], []
-        for _, r in df.iterrows():
-            la, lo = _fallback_coords(r)
-            lats.append(la); lons.append(lo)
-        df["lat"] = lats; df["lon"] = lons
-        return df, True, None
+    # Sem lat/lon completos: usa o centro do país (map vetorizado)
+    has_coords = lat.notna() & lon.notna()
+    ctry = df["output_country"].astype(str).str.strip()
+    df["lat"] = lat.where(has_coords, ctry.map(_COUNTRY_LAT_S))
+    df["lon"] = lon.where(has_coords, ctry.map(_COUNTRY_LON_S))
+    return df
+
+def load_outputs_public():
+    try:
+        raw, fp = _fetch_outputs_raw()
+    except RuntimeError as e:
+        return pd.DataFrame(), False, str(e)
+    if raw.empty:
+        return raw, True, None
+    try:
+        return _postprocess_outputs(fp, raw), True, None
     except Exception as e:
         return pd.DataFrame(), False, f"Read error: {e}"
 
+if DEBUG_CACHE:
+    _cache_counters()["runs"] += 1
+
 if st.sidebar.button("🔄 Check updates"):
-    load_projects_public.clear(); load_outputs_public.clear(); load_country_centers.clear()
+    _drop_snapshot()
+    _fetch_sheets_raw.clear(); _load_projects_frame.clear(); _fetch_outputs_raw.clear()
+    load_country_centers.clear()
+    _cached_worksheet.clear()
     st.rerun()
 
 df_projects, okP, msgP = load_projects_public()
 if not okP and msgP:
     st.caption(f"⚠️ {msgP}")
 
+# Lido uma vez por render e reusado no mapa (7) e na tabela (8): ambos só
+# filtram ou criam frames novos, nunca alteram este DataFrame.
+df_outputs_all, okO, msgO = load_outputs_public()
+
 # ──────────────────────────────────────────────────────────────────────────────
 # 7) Mapa (outputs aprovados)
 # ──────────────────────────────────────────────────────────────────────────────
-st.subheader("Projects & outputs map (approved outputs)")
-df_outputs_map, okOm, msgOm = load_outputs_public()
-if not okOm and msgOm:
-    st.caption(f"⚠️ {msgOm}")
-else:
-    has_coords = (not df_outputs_map.empty) and (df_outputs_map[["lat","lon"]].dropna().shape[0] > 0)
-    if has_coords:
-        dfc = df_outputs_map.dropna(subset=["lat","lon"]).copy()
-        center_lat, center_lon = (dfc["lat"].mean(), dfc["lon"].mean()) if not dfc.empty else (0, 0)
-        m = folium.Map(location=[center_lat, center_lon], zoom_start=2, tiles="CartoDB dark_matter")
-        groups = dfc.groupby(["output_country","lat","lon"], as_index=False)
-        for (country, lat, lon), g in groups:
-            proj_info = {}
-            for _, r in g.iterrows():
-                proj = (str(r.get("project","")).strip() or "(unnamed)")
-                out_title = str(r.get("output_title","")).strip()
-                out_url = _clean_url(r.get("output_url",""))
-                proj_info.setdefault(proj, [])
-                proj_info[proj].append((out_title, out_url))
-            lines = ["<div style='font-size:0.9rem; color:#0f172a;'>",
-                     f"<b>{country if country else '—'}</b>",
-                     "<ul style='padding-left:1rem; margin:0;'>"]
-            for proj, outs in proj_info.items():
-                inner = []
-                for (t, u) in outs:
-                    if t:
-                        inner.append(f"{t} (<a href='{u}' target='_blank' style='color:#2563eb;text-decoration:none;'>link</a>)" if u else t)
-                inner_txt = "; ".join(inner) if inner else "—"
-                lines.append(f"<li><b>{proj}</b> — {inner_txt}</li>")
-            lines.append("</ul></div>")
-            html_block = "".join(lines)
-            folium.CircleMarker(
-                location=[lat, lon], radius=6, color="#38bdf8", fill=True, fill_opacity=0.9,
-                tooltip=folium.Tooltip(html_block, sticky=True, direction='top',
-                                       style="background:#ffffff; color:#0f172a; border:1px solid #cbd5e1; border-radius:8px; padding:8px;"),
-                popup=folium.Popup(html_block, max_width=420),
-            ).add_to(m)
-        st_folium(m, height=520, width=None)
+_MAP_TOOLTIP_STYLE = "background:#ffffff; color:#0f172a; border:1px solid #cbd5e1; border-radius:8px; padding:8px;"
+# Estilo dos popups/tooltips declarado uma vez no <head> do mapa (o HTML de cada ponto só leva classes)
+_MAP_POPUP_CSS = (
+    "<style>.om{font-size:0.9rem;color:#0f172a}"
+    ".om ul{padding-left:1rem;margin:0}"
+    ".om a{color:#2563eb;text-decoration:none}</style>"
+)
+
+def _outputs_map_features(dfc: pd.DataFrame) -> List[dict]:
+    """Um Feature GeoJSON por (país, lat, lon), com o HTML do popup em properties."""
+    # Uma linha por (ponto, projeto) com as listas de títulos/URLs, sem iterrows
+    agg = dfc.assign(
+        project=dfc["project"].astype(str).str.strip().replace("", "(unnamed)"),
+        output_title=dfc["output_title"].astype(str).str.strip(),
+        output_url=dfc["output_url"].map(_clean_url),
+    ).groupby(["output_country","lat","lon","project"], sort=False).agg(
+        titles=("output_title", list), urls=("output_url", list)
+    ).reset_index()
+
+    items = defaultdict(str)
+    for country, lat, lon, proj, titles, urls in agg.itertuples(index=False):
+        inner_txt = "; ".join(
+            f"{t} (<a href='{u}' target='_blank'>link</a>)" if u else t
+            for t, u in zip(titles, urls) if t
+        ) or "—"
+        items[(country, lat, lon)] += f"<li><b>{proj}</b> — {inner_txt}</li>"
+
+    features = []
+    for (country, lat, lon) in sorted(items):
+        html_block = f"<div class='om'><b>{country or '—'}</b><ul>{items[(country, lat, lon)]}</ul></div>"
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+            "properties": {"country": country, "html": html_block},
+        })
+    return features
+
+def _build_outputs_map(dfc: pd.DataFrame) -> "folium.Map":
+    """Mapa com todos os pontos numa única camada GeoJson (um passe no Leaflet)."""
+    import folium  # só quando um mapa é de fato montado (cache miss)
+    m = folium.Map(location=[dfc["lat"].mean(), dfc["lon"].mean()], zoom_start=2, tiles="CartoDB dark_matter")
+    m.get_root().header.add_child(folium.Element(_MAP_POPUP_CSS))
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": _outputs_map_features(dfc)},
+        marker=folium.CircleMarker(radius=6, color="#38bdf8", fill=True, fill_opacity=0.9),
+        tooltip=folium.GeoJsonTooltip(fields=["html"], labels=False, sticky=True,
+                                      direction="top", style=_MAP_TOOLTIP_STYLE),
+        popup=folium.GeoJsonPopup(fields=["html"], labels=False, max_width=420),
+    ).add_to(m)
+    return m
+
+_MAP_COLS = ["output_country","lat","lon","project","output_title","output_url"]
+
+def _show_map_html(html_map: str, height: int):
+    """Mapas só de leitura: HTML pronto num iframe (sem o round-trip do st_folium)."""
+    if hasattr(st, "iframe"):
+        st.iframe(html_map, height=height)
     else:
-        st.info("No approved outputs with location yet.")
+        components.html(html_map, height=height, scrolling=False)
+
+@st.cache_data(ttl=SHEETS_TTL, max_entries=4, show_spinner=False)
+def _outputs_map_html(dfc: pd.DataFrame) -> str:
+    """HTML do mapa em cache, chaveado pelo hash do DataFrame (reruns não remontam o folium)."""
+    _count_miss("_outputs_map_html")
+    return _build_outputs_map(dfc).get_root().render()
+
+@st.fragment
+def outputs_map_fragment(df_out: pd.DataFrame, ok: bool, msg: Optional[str]):
+    """
+    Mapa só é montado com o expander aberto (evita montar o folium a cada rerun do form);
+    abrir/fechar reexecuta só este fragment. Streamlit sem `.open` no expander: toggle.
+    """
+    label = "Projects & outputs map (approved outputs)"
+    try:
+        exp = st.expander(label, key="_map_expander", on_change="rerun")
+    except TypeError:
+        exp = st.expander(label, expanded=ss.get("_map_open", False))
+    with exp:
+        map_open = getattr(exp, "open", None)
+        if map_open is None:
+            map_open = st.toggle("Load map", key="_map_open")
+        if not map_open:
+            return
+        if not ok and msg:
+            st.caption(f"⚠️ {msg}")
+            return
+        dfc = df_out.dropna(subset=["lat","lon"])[_MAP_COLS] if not df_out.empty else df_out
+        if dfc.empty:
+            st.info("No approved outputs with location yet.")
+            return
+        _show_map_html(_outputs_map_html(dfc), height=520)
+
+outputs_map_fragment(df_outputs_all, okO, msgO)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 8) Browse outputs — agregada por “mesmo output” (difere só em cidades)
@@ -503,7 +954,9 @@ def _aggregate_outputs(df_raw: pd.DataFrame) -> pd.DataFrame:
         return tuple((row.get(c, "") or "") for c in key_cols)
 
     groups = {}
-    for _, r in df_raw.iterrows():
+    # Dicts simples em vez de uma Series por linha (iterrows)
+    rec_cols = [c for c in key_cols + ["output_city", "sheet_row"] if c in df_raw.columns]
+    for r in df_raw[rec_cols].to_dict("records"):
         k = _row_key(r)
         entry = groups.get(k)
         cities_here = _normalize_city_list(r.get("output_city",""))
@@ -529,7 +982,7 @@ def _aggregate_outputs(df_raw: pd.DataFrame) -> pd.DataFrame:
         rec = dict(bundle["row_proto"])
         # cidades unificadas (ordena alfabeticamente para estabilidade)
         cities_sorted = sorted([c for c in bundle["cities"] if c], key=lambda x: x.lower())
-        rec["output_city"] = ", ".join(cities_sorted)
+        rec["output_city"] = _csv(cities_sorted)
         # mantém lat/lon como vazio (não exibimos no browser); para editar vamos usar países mesmo
         rec["sheet_rows"] = [sr for sr in bundle["sheet_rows"] if sr]
         out_records.append(rec)
@@ -541,221 +994,225 @@ def _aggregate_outputs(df_raw: pd.DataFrame) -> pd.DataFrame:
         df_ag = df_ag.sort_values(sort_cols, kind="stable").reset_index(drop=True)
     return df_ag
 
-df_outputs, okO, msgO = load_outputs_public()
-if not okO and msgO:
-    st.caption(f"⚠️ {msgO}")
-else:
-    if df_outputs.empty:
-        st.info("No outputs.")
-    else:
-        # Agrega (linhas iguais exceto cidades)
-        df_aggr = _aggregate_outputs(df_outputs)
-
-        # Prepara preview: SEM sheet_row
-        preview_cols = ["project","output_country","output_city","output_type","output_data_type"]
-        for c in preview_cols:
-            if c not in df_aggr.columns:
-                df_aggr[c] = ""
-
-        df_preview = df_aggr[preview_cols].copy()
-
-        details_col = "See full information"
-        SELECT_COL  = "Select"
-        df_preview[details_col] = False
-        df_preview[SELECT_COL]  = False
-
-        editor_key = f"outputs_editor_{ss._outputs_editor_key_version}"
-        edited = st.data_editor(
-            df_preview,
-            key=editor_key,
-            use_container_width=True,
-            hide_index=True,
-            disabled=preview_cols,
-            column_config={
-                "project": st.column_config.TextColumn("project"),
-                "output_country": st.column_config.TextColumn("output_country"),
-                "output_city": st.column_config.TextColumn("output_city"),
-                "output_type": st.column_config.TextColumn("output_type"),
-                "output_data_type": st.column_config.TextColumn("output_data_type"),
-                details_col: st.column_config.CheckboxColumn(details_col, help="Open details for this row"),
-                SELECT_COL:  st.column_config.CheckboxColumn(SELECT_COL, help="Select one row to edit/remove"),
-            }
-        )
+@st.fragment
+def browse_outputs_fragment(df_aggr: pd.DataFrame):
+    """
+    Tabela + detalhes + Edit/Remove isolados num fragment: marcar checkboxes
+    reexecuta só este bloco (Edit/Remove ainda fazem rerun completo).
+    """
+    # Prepara preview: SEM sheet_row
+    preview_cols = ["project","output_country","output_city","output_type","output_data_type"]
+    details_col = "See full information"
+    SELECT_COL  = "Select"
+    # Um único frame novo (colunas ausentes viram ""); df_aggr fica intacto para os lookups
+    df_preview = df_aggr.reindex(columns=preview_cols, fill_value="").assign(
+        **{details_col: False, SELECT_COL: False}
+    )
 
-        # detalhes
-        if details_col in edited.columns:
-            det_idx = [i for i, v in enumerate(edited[details_col].tolist()) if bool(v)]
-            if det_idx and not ss._want_open_dialog:
-                ss._selected_output_idx = int(det_idx[0])
-                ss._want_open_dialog = True
+    editor_key = f"outputs_editor_{ss._outputs_editor_key_version}"
+    edited = st.data_editor(
+        df_preview,
+        key=editor_key,
+        use_container_width=True,
+        hide_index=True,
+        disabled=preview_cols,
+        column_config={
+            "project": st.column_config.TextColumn("project"),
+            "output_country": st.column_config.TextColumn("output_country"),
+            "output_city": st.column_config.TextColumn("output_city"),
+            "output_type": st.column_config.TextColumn("output_type"),
+            "output_data_type": st.column_config.TextColumn("output_data_type"),
+            details_col: st.column_config.CheckboxColumn(details_col, help="Open details for this row"),
+            SELECT_COL:  st.column_config.CheckboxColumn(SELECT_COL, help="Select one row to edit/remove"),
+        }
+    )
+
+    # detalhes
+    if details_col in edited.columns:
+        det_idx = [i for i, v in enumerate(edited[details_col].tolist()) if bool(v)]
+        if det_idx and not ss._want_open_dialog:
+            ss._selected_output_idx = int(det_idx[0])
+            ss._want_open_dialog = True
+            ss._outputs_editor_key_version += 1
+            rerun_fragment()
+
+    def _render_full_info_md(row):
+        show_cols = [
+            ("project","Project"),
+            ("project_url","Project URL"),
+            ("output_title","Output title"),
+            ("output_type","Output type"),
+            ("output_data_type","Output data type"),
+            ("output_url","Output URL"),
+            ("output_country","Output country"),
+            ("output_city","Output city (aggregated)"),
+            ("output_year","Output year"),
+            ("output_desc","Description"),
+            ("output_contact","Contact"),
+            ("output_linkedin","LinkedIn"),
+        ]
+        lines = []
+        for key, nice in show_cols:
+            val = str(row.get(key,"")).strip()
+            if key in ("project_url","output_url") and val:
+                val = f"[{val}]({val})"
+            lines.append(f"- **{nice}:** {val if val else '—'}")
+        st.markdown("\n".join(lines))
+
+    def _open_details(row):
+        try:
+            @st.dialog("Full information")
+            def _dialog(rdict):
+                _render_full_info_md(rdict)
+            _dialog(row.to_dict())
+        except Exception:
+            with st.container(border=True):
+                st.markdown("### Full information")
+                _render_full_info_md(row)
+                st.button(
+                    "Close",
+                    key=f"close_inline_details_{_ulid_like()}",
+                    on_click=lambda: ss.update({"_want_open_dialog": False, "_selected_output_idx": None})
+                )
+
+    if ss._want_open_dialog:
+        idx = ss._selected_output_idx
+        if isinstance(idx, int) and (0 <= idx < len(df_aggr)):
+            row = df_aggr.iloc[idx]
+            _open_details(row)
+        ss._want_open_dialog = False
+        ss._selected_output_idx = None
+
+    # seleção única (na agregada)
+    sel_idxs = [i for i, v in enumerate(edited[SELECT_COL].tolist()) if bool(v)] if SELECT_COL in edited.columns else []
+    if sel_idxs:
+        ss._table_selection = int(sel_idxs[0])
+
+    # Campo Reason + botões
+    st.write("")  # espaçamento
+    ss._action_reason = st.text_input("Reason (required for Edit or Remove)", value=ss._action_reason)
+    colA, colB = st.columns([1,1])
+
+    # ----- EDIT SELECTED (usa primeira sheet_row do grupo) -----
+    with colA:
+        if st.button("✏️ Edit selected", use_container_width=True):
+            missing = _collect_missing_for_table_action(ss._table_selection, ss._action_reason, "Edit")
+            if missing:
+                _show_missing(missing)
+            else:
+                base_row = df_aggr.iloc[ss._table_selection].to_dict()
+                # pega a primeira linha original como alvo
+                sheet_rows = df_aggr.iloc[ss._table_selection].get("sheet_rows", [])
+                sheet_row = int(sheet_rows[0]) if sheet_rows else None
+
+                # Pré-popula o formulário com cidades agregadas
+                ss[wkey("submitter_email")] = ""  # quem edita informa seu e-mail
+                proj_name = (base_row.get("project") or "").strip()
+                ss[wkey("project_tax_sel")] = proj_name if proj_name in PROJECT_TAXONOMY else "Other: ______"
+                if ss[wkey("project_tax_sel")].startswith(OTHER_PREFIX):
+                    ss[wkey("project_tax_other")] = proj_name
+                ss[wkey("output_type_sel")] = (base_row.get("output_type") or "") or OUTPUT_TYPES[0]
+                ss[wkey("output_type_other")] = (base_row.get("output_type_other") or "")
+                if ss[wkey("output_type_sel")] == DATASET:
+                    ss[wkey("output_data_type")] = (base_row.get("output_data_type") or SELECT_PLACEHOLDER)
+                ss[wkey("output_title")] = (base_row.get("output_title") or "")
+                ss[wkey("output_url")]   = (base_row.get("output_url") or "")
+                # países (em agregada já estão unificados em 1 célula; mantemos como veio)
+                countries = []
+                oc = (base_row.get("output_country") or "").strip()
+                if oc:
+                    parts = [p.strip() for p in oc.split(",") if p.strip()]
+                    countries = parts if len(parts) > 1 else [oc]
+                ss[wkey("output_countries")] = countries
+                # cidades agregadas
+                ss.form_data["cities"] = []
+                ocity = (base_row.get("output_city") or "").strip()
+                if ocity:
+                    for p in [p.strip() for p in ocity.split(",") if p.strip()]:
+                        ss.form_data["cities"].append(p)
+                # anos
+                years_txt = (base_row.get("output_year") or "").strip()
+                years = []
+                if years_txt:
+                    for y in years_txt.split(","):
+                        y = y.strip()
+                        if y.isdigit():
+                            years.append(int(y))
+                ss[wkey("years_selected")] = years
+                # outros
+                ss[wkey("output_desc")]            = (base_row.get("output_desc") or "")
+                ss[wkey("output_contact")]         = (base_row.get("output_contact") or "")
+                ss[wkey("output_linkedin")]        = (base_row.get("output_linkedin") or "")
+                ss[wkey("project_url_for_output")] = (base_row.get("project_url") or "")
+                # flags de edição
+                ss["_edit_mode"]       = True
+                ss["_edit_reason"]     = ss._action_reason.strip()
+                ss["_edit_target_row"] = int(sheet_row) if sheet_row else None
+
+                flash("✏️ Edit mode enabled. The form below is pre-filled — complete your email and submit.", "info")
                 ss._outputs_editor_key_version += 1
+                ss._table_selection = None
+                ss._action_reason = ""
                 st.rerun()
 
-        def _render_full_info_md(row):
-            show_cols = [
-                ("project","Project"),
-                ("project_url","Project URL"),
-                ("output_title","Output title"),
-                ("output_type","Output type"),
-                ("output_data_type","Output data type"),
-                ("output_url","Output URL"),
-                ("output_country","Output country"),
-                ("output_city","Output city (aggregated)"),
-                ("output_year","Output year"),
-                ("output_desc","Description"),
-                ("output_contact","Contact"),
-                ("output_linkedin","LinkedIn"),
-            ]
-            lines = []
-            for key, nice in show_cols:
-                val = str(row.get(key,"")).strip()
-                if key in ("project_url","output_url") and val:
-                    val = f"[{val}]({val})"
-                lines.append(f"- **{nice}:** {val if val else '—'}")
-            st.markdown("\n".join(lines))
-
-        def _open_details(row):
-            try:
-                @st.dialog("Full information")
-                def _dialog(rdict):
-                    _render_full_info_md(rdict)
-                _dialog(row.to_dict())
-            except Exception:
-                with st.container(border=True):
-                    st.markdown("### Full information")
-                    _render_full_info_md(row)
-                    st.button(
-                        "Close",
-                        key=f"close_inline_details_{_ulid_like()}",
-                        on_click=lambda: ss.update({"_want_open_dialog": False, "_selected_output_idx": None})
-                    )
-
-        if ss._want_open_dialog:
-            idx = ss._selected_output_idx
-            if isinstance(idx, int) and (0 <= idx < len(df_aggr)):
-                row = df_aggr.iloc[idx]
-                _open_details(row)
-            ss._want_open_dialog = False
-            ss._selected_output_idx = None
-
-        # seleção única (na agregada)
-        sel_idxs = [i for i, v in enumerate(edited[SELECT_COL].tolist()) if bool(v)] if SELECT_COL in edited.columns else []
-        if sel_idxs:
-            ss._table_selection = int(sel_idxs[0])
-
-        # Campo Reason + botões
-        st.write("")  # espaçamento
-        ss._action_reason = st.text_input("Reason (required for Edit or Remove)", value=ss._action_reason)
-        colA, colB = st.columns([1,1])
-
-        # ----- EDIT SELECTED (usa primeira sheet_row do grupo) -----
-        with colA:
-            if st.button("✏️ Edit selected", use_container_width=True):
-                missing = _collect_missing_for_table_action(ss._table_selection, ss._action_reason, "Edit")
-                if missing:
-                    _show_missing(missing)
-                else:
-                    base_row = df_aggr.iloc[ss._table_selection].to_dict()
-                    # pega a primeira linha original como alvo
-                    sheet_rows = df_aggr.iloc[ss._table_selection].get("sheet_rows", [])
-                    sheet_row = int(sheet_rows[0]) if sheet_rows else None
-
-                    # Pré-popula o formulário com cidades agregadas
-                    ss[wkey("submitter_email")] = ""  # quem edita informa seu e-mail
-                    proj_name = (base_row.get("project") or "").strip()
-                    ss[wkey("project_tax_sel")] = proj_name if proj_name in PROJECT_TAXONOMY else "Other: ______"
-                    if ss[wkey("project_tax_sel")].startswith("Other"):
-                        ss[wkey("project_tax_other")] = proj_name
-                    ss[wkey("output_type_sel")] = (base_row.get("output_type") or "") or OUTPUT_TYPES[0]
-                    ss[wkey("output_type_other")] = (base_row.get("output_type_other") or "")
-                    if ss[wkey("output_type_sel")] == "Dataset":
-                        ss[wkey("output_data_type")] = (base_row.get("output_data_type") or SELECT_PLACEHOLDER)
-                    ss[wkey("output_title")] = (base_row.get("output_title") or "")
-                    ss[wkey("output_url")]   = (base_row.get("output_url") or "")
-                    # países (em agregada já estão unificados em 1 célula; mantemos como veio)
-                    countries = []
-                    oc = (base_row.get("output_country") or "").strip()
-                    if oc:
-                        parts = [p.strip() for p in oc.split(",") if p.strip()]
-                        countries = parts if len(parts) > 1 else [oc]
-                    ss[wkey("output_countries")] = countries
-                    # cidades agregadas
-                    ss.form_data["cities"] = []
-                    ocity = (base_row.get("output_city") or "").strip()
-                    if ocity:
-                        for p in [p.strip() for p in ocity.split(",") if p.strip()]:
-                            ss.form_data["cities"].append(p)
-                    # anos
-                    years_txt = (base_row.get("output_year") or "").strip()
-                    years = []
-                    if years_txt:
-                        for y in years_txt.split(","):
-                            y = y.strip()
-                            if y.isdigit():
-                                years.append(int(y))
-                    ss[wkey("years_selected")] = years
-                    # outros
-                    ss[wkey("output_desc")]            = (base_row.get("output_desc") or "")
-                    ss[wkey("output_contact")]         = (base_row.get("output_contact") or "")
-                    ss[wkey("output_linkedin")]        = (base_row.get("output_linkedin") or "")
-                    ss[wkey("project_url_for_output")] = (base_row.get("project_url") or "")
-                    # flags de edição
-                    ss["_edit_mode"]       = True
-                    ss["_edit_reason"]     = ss._action_reason.strip()
-                    ss["_edit_target_row"] = int(sheet_row) if sheet_row else None
-
-                    flash("✏️ Edit mode enabled. The form below is pre-filled — complete your email and submit.", "info")
-                    ss._outputs_editor_key_version += 1
-                    ss._table_selection = None
-                    ss._action_reason = ""
-                    st.rerun()
+    # ----- REMOVE SELECTED (gera 1 solicitação usando a primeira sheet_row) -----
+    with colB:
+        if st.button("🗑️ Remove selected", use_container_width=True):
+            missing = _collect_missing_for_table_action(ss._table_selection, ss._action_reason, "Remove")
+            if missing:
+                _show_missing(missing)
+            else:
+                base_row = df_aggr.iloc[ss._table_selection].to_dict()
+                sheet_rows = df_aggr.iloc[ss._table_selection].get("sheet_rows", [])
+                sheet_row = int(sheet_rows[0]) if sheet_rows else None
 
-        # ----- REMOVE SELECTED (gera 1 solicitação usando a primeira sheet_row) -----
-        with colB:
-            if st.button("🗑️ Remove selected", use_container_width=True):
-                missing = _collect_missing_for_table_action(ss._table_selection, ss._action_reason, "Remove")
-                if missing:
-                    _show_missing(missing)
+                wsO, errO = ws_outputs()
+                if errO or wsO is None:
+                    st.error(errO or "Worksheet unavailable for outputs.")
                 else:
-                    base_row = df_aggr.iloc[ss._table_selection].to_dict()
-                    sheet_rows = df_aggr.iloc[ss._table_selection].get("sheet_rows", [])
-                    sheet_row = int(sheet_rows[0]) if sheet_rows else None
-
-                    wsO, errO = ws_outputs()
-                    if errO or wsO is None:
-                        st.error(errO or "Worksheet unavailable for outputs.")
+                    rowO = {
+                        "project": (base_row.get("project") or ""),
+                        "output_title": (base_row.get("output_title") or ""),
+                        "output_type": (base_row.get("output_type") or ""),
+                        "output_type_other": (base_row.get("output_type_other") or ""),
+                        "output_data_type": (base_row.get("output_data_type") or ""),
+                        "output_url": (base_row.get("output_url") or ""),
+                        "output_country": (base_row.get("output_country") or ""),
+                        "output_country_other": (base_row.get("output_country_other") or ""),
+                        "output_city": (base_row.get("output_city") or ""),  # já agregado
+                        "output_year": (base_row.get("output_year") or ""),
+                        "output_desc": (base_row.get("output_desc") or ""),
+                        "output_contact": (base_row.get("output_contact") or ""),
+                        "output_email": "",
+                        "output_linkedin": (base_row.get("output_linkedin") or ""),
+                        "project_url": (base_row.get("project_url") or ""),
+                        "submitter_email": "",
+                        "is_edit": "TRUE",
+                        "edit_target": str(sheet_row or ""),
+                        "edit_request": f"REMOVE REQUEST: {ss._action_reason.strip()}",
+                        "approved": "FALSE",
+                        "created_at": _now_iso(),
+                        "lat": "", "lon": "",
+                    }
+                    ok, msg = _append_row(wsO, OUTPUTS_HEADERS, rowO)
+                    if not ok:
+                        st.error(msg)
                     else:
-                        rowO = {
-                            "project": (base_row.get("project") or ""),
-                            "output_title": (base_row.get("output_title") or ""),
-                            "output_type": (base_row.get("output_type") or ""),
-                            "output_type_other": (base_row.get("output_type_other") or ""),
-                            "output_data_type": (base_row.get("output_data_type") or ""),
-                            "output_url": (base_row.get("output_url") or ""),
-                            "output_country": (base_row.get("output_country") or ""),
-                            "output_country_other": (base_row.get("output_country_other") or ""),
-                            "output_city": (base_row.get("output_city") or ""),  # já agregado
-                            "output_year": (base_row.get("output_year") or ""),
-                            "output_desc": (base_row.get("output_desc") or ""),
-                            "output_contact": (base_row.get("output_contact") or ""),
-                            "output_email": "",
-                            "output_linkedin": (base_row.get("output_linkedin") or ""),
-                            "project_url": (base_row.get("project_url") or ""),
-                            "submitter_email": "",
-                            "is_edit": "TRUE",
-                            "edit_target": str(sheet_row or ""),
-                            "edit_request": f"REMOVE REQUEST: {ss._action_reason.strip()}",
-                            "approved": "FALSE",
-                            "created_at": datetime.utcnow().isoformat(timespec="seconds")+"Z",
-                            "lat": "", "lon": "",
-                        }
-                        _append_row(wsO, OUTPUTS_HEADERS, rowO)
                         flash("🗑️ Removal request sent for review.", "success")
                         ss._outputs_editor_key_version += 1
                         ss._table_selection = None
                         ss._action_reason = ""
                         st.rerun()
 
+if not okO and msgO:
+    st.caption(f"⚠️ {msgO}")
+else:
+    if df_outputs_all.empty:
+        st.info("No outputs.")
+    else:
+        # Agrega (linhas iguais exceto cidades)
+        browse_outputs_fragment(_aggregate_outputs(df_outputs_all))
+
 # ──────────────────────────────────────────────────────────────────────────────
 # 9) SUBMISSÃO — Reativo + Reuso países/cidades + 1 linha por país
 # ──────────────────────────────────────────────────────────────────────────────
@@ -788,147 +1245,45 @@ def render_cities_list(title="Added cities"):
                 st.button("🗑️ Remove", key=wkey(f"remove_{title}_{i}"),
                           on_click=lambda i=i: remove_city(i))
 
-def hard_reset_form():
-    ss.form_data = {"cities": []}
-    ss._edit_mode = False
-    ss._edit_reason = ""
-    ss._edit_target_row = None
-    ss._form_version += 1
-
-# Campos básicos
-st.subheader("Basic Information")
-
-submitter_email = st.text_input(
-    "Submitter email (required for review)*",
-    placeholder="name@org.org",
-    key=wkey("submitter_email")
-)
-
-project_tax_sel = st.selectbox(
-    "Project Name (taxonomy)*",
-    options=PROJECT_TAXONOMY,
-    key=wkey("project_tax_sel")
-)
-is_other_project = project_tax_sel.startswith("Other")
-project_tax_other = st.text_input(
-    "Please specify the project (taxonomy)*",
-    key=wkey("project_tax_other")
-) if is_other_project else ""
-
-output_type_sel = st.selectbox("Output Type*", options=OUTPUT_TYPES, key=wkey("output_type_sel"))
-
-if output_type_sel == "Dataset":
-    output_data_type = st.selectbox(
-        "Data type (for datasets)*",
-        options=[SELECT_PLACEHOLDER] + DATASET_DTYPES,
-        key=wkey("output_data_type")
-    )
-else:
-    output_data_type = ""
-
-output_type_other = ""
-if output_type_sel.startswith("Other"):
-    output_type_other = st.text_input("Please specify the output type*", key=wkey("output_type_other"))
-
-output_title = st.text_input("Output Name*", key=wkey("output_title"))
-output_url = st.text_input("Output URL (optional)", key=wkey("output_url"))
-
-# Cobertura geográfica (única para output e para projeto "Other")
-st.subheader("Geographic Coverage")
-output_countries = st.multiselect(
-    "Select countries (select 'Global' for worldwide coverage)*",
-    options=_countries_with_global_first(COUNTRY_NAMES) + ["Other: ______"],
-    key=wkey("output_countries")
-)
-is_global = "Global" in (output_countries or [])
-output_country_other = st.text_input(
-    "Please specify other geographic coverage",
-    key=wkey("output_country_other")
-) if ("Other: ______" in (output_countries or [])) else ""
-
-# Cidades (reativo)
-if output_countries and not is_global:
-    available_countries = [c for c in output_countries if c not in ["Global", "Other: ______"]]
-    if available_countries:
-        st.write("**Add cities (used for output and for new project if 'Other')**")
-        col_country_out, col_city_out, col_btn_out = st.columns([2, 2, 1])
-        with col_country_out:
-            st.selectbox(
-                "Select country",
-                options=[SELECT_PLACEHOLDER] + available_countries,
-                key=wkey("output_country_select")
-            )
-        with col_city_out:
-            st.text_input(
-                "City name (accepts multiple, separated by commas)*",
-                placeholder="Enter city name",
-                key=wkey("output_city_input")
-            )
-        def _cb_add_output_city():
-            if add_city(ss.get(wkey("output_country_select")), ss.get(wkey("output_city_input"), "")):
-                ss[wkey("output_city_input")] = ""
-        with col_btn_out:
-            st.write(""); st.write("")
-            st.button("➕ Add City", use_container_width=True, on_click=_cb_add_output_city, key=wkey("btn_add_city"))
-
-        render_cities_list("Added cities")
-elif is_global:
-    st.info("🌍 Global coverage selected - city selection is disabled")
-
-# Preview mapa
-if ss.form_data["cities"] and not is_global:
-    st.write("**Map Preview:**")
-    available_countries = [c for c in (output_countries or []) if c not in ["Global", "Other: ______"]]
-    if available_countries and available_countries[0] in COUNTRY_CENTER_FULL:
-        center_lat, center_lon = COUNTRY_CENTER_FULL[available_countries[0]]
-    else:
-        center_lat, center_lon = 0, 0
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _preview_map_html(countries: Tuple[str, ...], cities: Tuple[str, ...]) -> str:
+    """Preview do form em cache por (países, cidades): digitar nos outros campos não remonta o mapa."""
+    _count_miss("_preview_map_html")
+    import folium
+    first_country = next((c for c in countries if c not in _NON_COUNTRY), None)
+    center_lat, center_lon = _center(first_country) or (0, 0)
     m = folium.Map(location=[center_lat, center_lon], zoom_start=3, tiles="CartoDB positron")
-    for country in (output_countries or []):
-        if country in COUNTRY_CENTER_FULL and country not in ["Global", "Other: ______"]:
+    for country in countries:
+        loc = _center(country) if country not in _NON_COUNTRY else None
+        if loc:
             folium.CircleMarker(
-                location=COUNTRY_CENTER_FULL[country],
+                location=loc,
                 radius=10, popup=country, tooltip=country,
                 color="blue", fill=True, fill_opacity=0.6
             ).add_to(m)
-    for pair in ss.form_data["cities"]:
+    for pair in cities:
         if "—" in pair:
             country, city = [p.strip() for p in pair.split("—", 1)]
-            if country in COUNTRY_CENTER_FULL:
+            loc = _center(country)
+            if loc:
                 folium.Marker(
-                    location=COUNTRY_CENTER_FULL[country],
+                    location=loc,
                     popup=f"{city}, {country}",
                     tooltip=f"{city}, {country}",
                     icon=folium.Icon(color="red", icon="info-sign")
                 ).add_to(m)
-    st_folium(m, height=300, width=None)
-
-# Info adicionais
-st.subheader("Additional Information")
-current_year = datetime.utcnow().year
-base_years_desc = list(range(current_year, 1999, -1))
-years_selected = st.multiselect("Year of output release", base_years_desc, key=wkey("years_selected"))
-
-output_desc = st.text_area("Short description of output", key=wkey("output_desc"))
-output_contact = st.text_input("Name & institution of person responsible", key=wkey("output_contact"))
-output_linkedin = st.text_input("LinkedIn address of contact", key=wkey("output_linkedin"))
-project_url_for_output = st.text_input("Project URL (optional, if different)", key=wkey("project_url_for_output"))
-
-# Se projeto é "Other": reuso países/cidades do coverage
-if is_other_project:
-    st.subheader("New Project Details (countries/cities reused from coverage above)")
-    new_project_url = st.text_input("Project URL (optional)", key=wkey("new_project_url"))
-    new_project_contact = st.text_input("Project contact / institution (optional)", key=wkey("new_project_contact"))
-else:
-    new_project_url = ""
-    new_project_contact = ""
+    return m.get_root().render()
 
-# Ações
-col1, col2 = st.columns([1, 1])
+def hard_reset_form():
+    ss.form_data = {"cities": []}
+    ss._edit_mode = False
+    ss._edit_reason = ""
+    ss._edit_target_row = None
+    ss._form_version += 1
 
 def _cb_clear():
+    # on_click já dispara um rerun ao fim do callback; não precisa de st.rerun() aqui
     hard_reset_form()
-    st.rerun()
 
 def _cb_submit():
     state = {k: ss.get(wkey(k)) for k in [
@@ -938,6 +1293,8 @@ def _cb_submit():
         "output_linkedin","project_url_for_output","new_project_url","new_project_contact",
         "output_type_other"
     ]}
+    # Texto livre normalizado uma única vez, na entrada
+    state = {k: (v.strip() if isinstance(v, str) else v) for k, v in state.items()}
 
     is_edit_mode_local = bool(ss.get("_edit_mode"))
     missing = _collect_missing_for_submit(
@@ -949,147 +1306,301 @@ def _cb_submit():
         _show_missing(missing)
         return
 
-    try:
-        # 1) Projeto "Other": grava por país (e por cidade)
-        is_other_project_local = (state["project_tax_sel"] or "").startswith("Other")
-        if is_other_project_local:
-            wsP, errP = ws_projects()
-            if errP or wsP is None:
-                st.error(errP or "Worksheet unavailable for projects.")
-                return
-
-            def _cities_for_country(country_name: str):
-                out = []
-                for pair in ss.form_data["cities"]:
-                    if "—" in pair:
-                        ctry, city = [p.strip() for p in pair.split("—", 1)]
-                        if ctry == country_name:
-                            out.append(city)
-                return out
-
-            normal_countries = [c for c in (state["output_countries"] or []) if c not in ["Global", "Other: ______"]]
-            if normal_countries:
-                for country in normal_countries:
-                    latp, lonp = COUNTRY_CENTER_FULL.get(country, (None, None))
-                    rowP_country = {
-                        "country": country, "city": "", "lat": latp, "lon": lonp,
-                        "project_name": (state["project_tax_other"] or "").strip(),
+    # Um único timestamp para todas as linhas desta submissão
+    created_at = _now_iso()
+
+    is_other_project_local = (state["project_tax_sel"] or "").startswith(OTHER_PREFIX)
+
+    # Países: uma varredura da seleção, reusada por projetos e outputs
+    output_countries_list = state["output_countries"] or []
+    country_set = set(output_countries_list)
+    normal_countries = [c for c in output_countries_list if c not in _NON_COUNTRY]
+    normal_centers = _centers_for(normal_countries)
+
+    # Abre as abas antes de montar qualquer linha: se uma falhar, nada é gravado
+    wsO, errO = ws_outputs()
+    if errO or wsO is None:
+        st.error(errO or "Worksheet unavailable for outputs.")
+        return
+    wsP = None
+    if is_other_project_local:
+        wsP, errP = ws_projects()
+        if errP or wsP is None:
+            st.error(errP or "Worksheet unavailable for projects.")
+            return
+
+    # 1) Projeto "Other": 1 linha por país (e por cidade)
+    rowsP = []
+    if is_other_project_local:
+        def _cities_for_country(country_name: str):
+            out = []
+            for pair in ss.form_data["cities"]:
+                if "—" in pair:
+                    ctry, city = [p.strip() for p in pair.split("—", 1)]
+                    if ctry == country_name:
+                        out.append(city)
+            return out
+
+        if normal_countries:
+            for country, latp, lonp in normal_centers:
+                rowP_country = {
+                    "country": country, "city": "", "lat": latp, "lon": lonp,
+                    "project_name": (state["project_tax_other"] or ""),
+                    "years": "", "status": "", "data_types": "", "description": "",
+                    "contact": state["new_project_contact"] or "",
+                    "access": "", "url": state["new_project_url"] or "",
+                    "submitter_email": state["submitter_email"] or "",
+                    "is_edit": "FALSE","edit_target": "","edit_request": "New project via output submission",
+                    "approved": "FALSE",
+                    "created_at": created_at,
+                }
+                rowsP.append(rowP_country)
+                for city in _cities_for_country(country):
+                    rowP_city = {
+                        "country": country, "city": city, "lat": latp, "lon": lonp,
+                        "project_name": (state["project_tax_other"] or ""),
                         "years": "", "status": "", "data_types": "", "description": "",
                         "contact": state["new_project_contact"] or "",
                         "access": "", "url": state["new_project_url"] or "",
                         "submitter_email": state["submitter_email"] or "",
                         "is_edit": "FALSE","edit_target": "","edit_request": "New project via output submission",
                         "approved": "FALSE",
-                        "created_at": datetime.utcnow().isoformat(timespec="seconds")+"Z",
+                        "created_at": created_at,
                     }
-                    _append_row(wsP, PROJECTS_HEADERS, rowP_country)
-                    for city in _cities_for_country(country):
-                        rowP_city = {
-                            "country": country, "city": city, "lat": latp, "lon": lonp,
-                            "project_name": (state["project_tax_other"] or "").strip(),
-                            "years": "", "status": "", "data_types": "", "description": "",
-                            "contact": state["new_project_contact"] or "",
-                            "access": "", "url": state["new_project_url"] or "",
-                            "submitter_email": state["submitter_email"] or "",
-                            "is_edit": "FALSE","edit_target": "","edit_request": "New project via output submission",
-                            "approved": "FALSE",
-                            "created_at": datetime.utcnow().isoformat(timespec="seconds")+"Z",
-                        }
-                        _append_row(wsP, PROJECTS_HEADERS, rowP_city)
-
-        # 2) Output — grava 1 linha por país (e Global/Other)
-        wsO, errO = ws_outputs()
-        if errO or wsO is None:
-            st.error(errO or "Worksheet unavailable for outputs.")
-            return
+                    rowsP.append(rowP_city)
+
+    # 2) Output — 1 linha por país (e Global/Other)
+    final_years_sorted_desc = sorted(dict.fromkeys(state["years_selected"] or []), reverse=True)
+    final_years_str = _csv(final_years_sorted_desc, ",")
+
+    def _cities_for_country_full(country_name: str):
+        out = []
+        for pair in ss.form_data["cities"]:
+            if "—" in pair:
+                ctry, city = [p.strip() for p in pair.split("—", 1)]
+                if ctry == country_name:
+                    out.append(pair)  # mantém "País — Cidade"
+        return _csv(out)
+
+    # Flags do tipo de output calculadas uma vez (usadas em todas as linhas)
+    is_other_type = (state["output_type_sel"] or "").startswith(OTHER_PREFIX)
+    is_dataset = state["output_type_sel"] == DATASET
+
+    # Campos de edição iguais para todas as linhas
+    if ss.get("_edit_mode"):
+        is_edit = "TRUE"
+        edit_target = str(ss.get("_edit_target_row") or "")
+        edit_request = f"EDIT REQUEST: {ss.get('_edit_reason') or 'No reason provided'}"
+    else:
+        is_edit, edit_target, edit_request = "FALSE", "", "New submission"
+
+    # Valores que não dependem do país, resolvidos uma vez
+    project_val = (state["project_tax_other"] or "") if is_other_project_local else state["project_tax_sel"]
+    output_type_val = "" if is_other_type else (state["output_type_sel"] or "")
+    output_type_other_val = (state["output_type_other"] or "") if is_other_type else ""
+    output_data_type_val = (state["output_data_type"] or "") if is_dataset else ""
+    project_url_val = state["project_url_for_output"] or ((state["new_project_url"] or "") if is_other_project_local else "")
+    output_title_val = state["output_title"] or ""
+    output_url_val = state["output_url"] or ""
+    output_desc_val = state["output_desc"] or ""
+    output_contact_val = state["output_contact"] or ""
+    output_linkedin_val = state["output_linkedin"] or ""
+    submitter_email_val = state["submitter_email"] or ""
+
+    def _row_base(country_value: str, lat_o, lon_o, other_txt: str, output_city: str) -> OutputRow:
+        return OutputRow(
+            project=project_val,
+            output_title=output_title_val,
+            output_type=output_type_val,
+            output_type_other=output_type_other_val,
+            output_data_type=output_data_type_val,
+            output_url=output_url_val,
+            output_country=country_value,
+            output_country_other=other_txt,
+            output_city=output_city,
+            output_year=final_years_str,
+            output_desc=output_desc_val,
+            output_contact=output_contact_val,
+            output_email="",
+            output_linkedin=output_linkedin_val,
+            project_url=project_url_val,
+            submitter_email=submitter_email_val,
+            is_edit=is_edit,
+            edit_target=edit_target,
+            edit_request=edit_request,
+            approved="FALSE",
+            created_at=created_at,
+            lat=lat_o if lat_o is not None else "",
+            lon=lon_o if lon_o is not None else "",
+        )
 
-        output_countries_list = state["output_countries"] or []
-        final_years_sorted_desc = sorted(set(state["years_selected"] or []), reverse=True)
-        final_years_str = ",".join(str(y) for y in final_years_sorted_desc) if final_years_sorted_desc else ""
+    rowsO = []
+
+    if GLOBAL in country_set:
+        rowsO.append(_row_base(GLOBAL, None, None, "", _csv(ss.form_data["cities"])))
+
+    if OTHER_COUNTRY in country_set:
+        other_txt = state["output_country_other"] or "Other"
+        rowsO.append(_row_base(other_txt, None, None, other_txt, _csv(ss.form_data["cities"])))
+
+    for country, lat_o, lon_o in normal_centers:
+        rowsO.append(_row_base(country, lat_o, lon_o, "", _cities_for_country_full(country)))
+
+    if rowsO:
+        # Gravação em background; falha aparece no form (ver pending_writes_poller)
+        ss._pending_writes = ss._pending_writes + [
+            _writer_pool().submit(_write_submission, wsP, rowsP, wsO, rowsO)
+        ]
+        ss._post_submit = True
+        ss._post_submit_msg = "✅ Output submission queued for review!"
+        ss["_edit_mode"] = False
+        ss["_edit_reason"] = ""
+        ss["_edit_target_row"] = None
+        hard_reset_form()
+        # Só o form precisa recomeçar (o diálogo de sucesso abre dentro do fragment)
+        rerun_fragment()
+    else:
+        st.error("⚠️ Could not write any output rows. Check your selections.")
 
-        def _cities_for_country_full(country_name: str):
-            out = []
-            for pair in ss.form_data["cities"]:
-                if "—" in pair:
-                    ctry, city = [p.strip() for p in pair.split("—", 1)]
-                    if ctry == country_name:
-                        out.append(pair)  # mantém "País — Cidade"
-            return ", ".join(out)
-
-        def _row_base(country_value: str, lat_o, lon_o, other_txt=""):
-            rb = {
-                "project": ((state["project_tax_other"] or "").strip() if (state["project_tax_sel"] or "").startswith("Other") else state["project_tax_sel"]),
-                "output_title": state["output_title"] or "",
-                "output_type": ("" if ((state["output_type_sel"] or "").startswith("Other")) else (state["output_type_sel"] or "")),
-                "output_type_other": ((state["output_type_other"] or "") if ((state["output_type_sel"] or "").startswith("Other")) else ""),
-                "output_data_type": ((state["output_data_type"] or "") if state["output_type_sel"]=="Dataset" else ""),
-                "output_url": state["output_url"] or "",
-                "output_country": country_value,
-                "output_country_other": other_txt,
-                "output_year": final_years_str,
-                "output_desc": state["output_desc"] or "",
-                "output_contact": state["output_contact"] or "",
-                "output_email": "",
-                "output_linkedin": state["output_linkedin"] or "",
-                "project_url": (state["project_url_for_output"] or (state["new_project_url"] if (state["project_tax_sel"] or "").startswith("Other") else "")),
-                "submitter_email": state["submitter_email"] or "",
-                "created_at": datetime.utcnow().isoformat(timespec="seconds")+"Z",
-                "lat": lat_o if lat_o is not None else "",
-                "lon": lon_o if lon_o is not None else "",
-            }
-            if ss.get("_edit_mode"):
-                rb["is_edit"] = "TRUE"
-                rb["edit_target"] = str(ss.get("_edit_target_row") or "")
-                rb["edit_request"] = f"EDIT REQUEST: {ss.get('_edit_reason') or 'No reason provided'}"
-            else:
-                rb["is_edit"] = "FALSE"
-                rb["edit_target"] = ""
-                rb["edit_request"] = "New submission"
-            rb["approved"] = "FALSE"
-            return rb
-
-        wrote_any = False
-
-        if "Global" in output_countries_list:
-            rowO = _row_base("Global", None, None, "")
-            rowO["output_city"] = ", ".join(ss.form_data["cities"])
-            _append_row(wsO, OUTPUTS_HEADERS, rowO)
-            wrote_any = True
-
-        if "Other: ______" in output_countries_list:
-            other_txt = (state["output_country_other"] or "").strip() or "Other"
-            rowO = _row_base(other_txt, None, None, other_txt)
-            rowO["output_city"] = ", ".join(ss.form_data["cities"])
-            _append_row(wsO, OUTPUTS_HEADERS, rowO)
-            wrote_any = True
-
-        normal_countries = [c for c in output_countries_list if c not in ["Global", "Other: ______"]]
-        for country in normal_countries:
-            lat_o, lon_o = COUNTRY_CENTER_FULL.get(country, (None, None))
-            rowO = _row_base(country, lat_o, lon_o, "")
-            rowO["output_city"] = _cities_for_country_full(country)
-            _append_row(wsO, OUTPUTS_HEADERS, rowO)
-            wrote_any = True
-
-        if wrote_any:
-            ss._post_submit = True
-            ss._post_submit_msg = "✅ Output submission queued for review!"
-            ss["_edit_mode"] = False
-            ss["_edit_reason"] = ""
-            ss["_edit_target_row"] = None
-            hard_reset_form()
-            st.rerun()
-        else:
-            st.error("⚠️ Could not write any output rows. Check your selections.")
-    except Exception as e:
-        st.error(f"An error occurred: {str(e)}")
+@st.fragment
+def submit_output_fragment():
+    """
+    Formulário isolado num fragment: cada widget reexecuta só o form, sem
+    reler o Sheets nem remontar mapa/tabela. O submit roda fora de callback
+    para poder reexecutar só o fragment e abrir o diálogo de sucesso aqui.
+    """
+    show_post_submit_dialog()
+    drain_pending_writes()
+    show_write_errors()
+    if ss._pending_writes:
+        pending_writes_poller()
+
+    # Campos básicos
+    st.subheader("Basic Information")
+
+    submitter_email = st.text_input(
+        "Submitter email (required for review)*",
+        placeholder="name@org.org",
+        key=wkey("submitter_email")
+    )
 
-with col1:
-    st.button("✅ Submit for Review", use_container_width=True, type="primary",
-              on_click=_cb_submit, key=wkey("btn_submit"))
-with col2:
-    st.button("🗑️ Clear Form", use_container_width=True, type="secondary",
-              on_click=_cb_clear, key=wkey("btn_clear"))
+    project_tax_sel = st.selectbox(
+        "Project Name (taxonomy)*",
+        options=PROJECT_TAXONOMY,
+        key=wkey("project_tax_sel")
+    )
+    is_other_project = project_tax_sel.startswith(OTHER_PREFIX)
+    project_tax_other = st.text_input(
+        "Please specify the project (taxonomy)*",
+        key=wkey("project_tax_other")
+    ) if is_other_project else ""
+
+    output_type_sel = st.selectbox("Output Type*", options=OUTPUT_TYPES, key=wkey("output_type_sel"))
+
+    if output_type_sel == DATASET:
+        output_data_type = st.selectbox(
+            "Data type (for datasets)*",
+            options=[SELECT_PLACEHOLDER] + DATASET_DTYPES,
+            key=wkey("output_data_type")
+        )
+    else:
+        output_data_type = ""
 
+    output_type_other = ""
+    if output_type_sel.startswith(OTHER_PREFIX):
+        output_type_other = st.text_input("Please specify the output type*", key=wkey("output_type_other"))
 
+    output_title = st.text_input("Output Name*", key=wkey("output_title"))
+    output_url = st.text_input("Output URL (optional)", key=wkey("output_url"))
 
+    # Cobertura geográfica (única para output e para projeto "Other")
+    st.subheader("Geographic Coverage")
+    output_countries = st.multiselect(
+        "Select countries (select 'Global' for worldwide coverage)*",
+        options=COUNTRY_OPTIONS,
+        key=wkey("output_countries")
+    )
+    is_global = GLOBAL in (output_countries or [])
+    output_country_other = st.text_input(
+        "Please specify other geographic coverage",
+        key=wkey("output_country_other")
+    ) if (OTHER_COUNTRY in (output_countries or [])) else ""
+
+    # Cidades (reativo)
+    if output_countries and not is_global:
+        available_countries = [c for c in output_countries if c not in _NON_COUNTRY]
+        if available_countries:
+            st.write("**Add cities (used for output and for new project if 'Other')**")
+            col_country_out, col_city_out, col_btn_out = st.columns([2, 2, 1])
+            with col_country_out:
+                st.selectbox(
+                    "Select country",
+                    options=[SELECT_PLACEHOLDER] + available_countries,
+                    key=wkey("output_country_select")
+                )
+            with col_city_out:
+                st.text_input(
+                    "City name (accepts multiple, separated by commas)*",
+                    placeholder="Enter city name",
+                    key=wkey("output_city_input")
+                )
+            def _cb_add_output_city():
+                if add_city(ss.get(wkey("output_country_select")), ss.get(wkey("output_city_input"), "")):
+                    ss[wkey("output_city_input")] = ""
+            with col_btn_out:
+                st.write(""); st.write("")
+                st.button("➕ Add City", use_container_width=True, on_click=_cb_add_output_city, key=wkey("btn_add_city"))
+
+            render_cities_list("Added cities")
+    elif is_global:
+        st.info("🌍 Global coverage selected - city selection is disabled")
+
+    # Preview mapa
+    if ss.form_data["cities"] and not is_global:
+        st.write("**Map Preview:**")
+        _show_map_html(_preview_map_html(tuple(output_countries or []), tuple(ss.form_data["cities"])), height=300)
+
+    # Info adicionais
+    st.subheader("Additional Information")
+    current_year = time.gmtime().tm_year
+    base_years_desc = list(range(current_year, 1999, -1))
+    years_selected = st.multiselect("Year of output release", base_years_desc, key=wkey("years_selected"))
+
+    output_desc = st.text_area("Short description of output", key=wkey("output_desc"))
+    output_contact = st.text_input("Name & institution of person responsible", key=wkey("output_contact"))
+    output_linkedin = st.text_input("LinkedIn address of contact", key=wkey("output_linkedin"))
+    project_url_for_output = st.text_input("Project URL (optional, if different)", key=wkey("project_url_for_output"))
+
+    # Se projeto é "Other": reuso países/cidades do coverage
+    if is_other_project:
+        st.subheader("New Project Details (countries/cities reused from coverage above)")
+        new_project_url = st.text_input("Project URL (optional)", key=wkey("new_project_url"))
+        new_project_contact = st.text_input("Project contact / institution (optional)", key=wkey("new_project_contact"))
+    else:
+        new_project_url = ""
+        new_project_contact = ""
+
+    # Ações
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        if st.button("✅ Submit for Review", use_container_width=True, type="primary",
+                     key=wkey("btn_submit")):
+            _cb_submit()
+    with col2:
+        st.button("🗑️ Clear Form", use_container_width=True, type="secondary",
+                  on_click=_cb_clear, key=wkey("btn_clear"))
+
+submit_output_fragment()
+
+# Diagnóstico de cache (só com DEBUG_CACHE em st.secrets): misses altos = TTL curto ou chave instável
+if DEBUG_CACHE:
+    with st.sidebar.expander("Cache debug"):
+        counters = _cache_counters()
+        st.caption(f"Script runs in this process: {counters['runs']}")
+        st.dataframe(
+            pd.DataFrame(
+                [(k, v, counters["last_miss"].get(k, "")) for k, v in counters["misses"].items()],
+                columns=["function", "misses", "last miss (UTC)"],
+            ),
+            hide_index=True,
+        )